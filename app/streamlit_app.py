@@ -1,17 +1,23 @@
+import gc
+import hashlib
+import io
+import logging
+import os
+import queue
 import sys
+from xml.sax.saxutils import escape
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import streamlit as st
 
 st.write("🔍 Python version:", sys.version)
 import streamlit as st
-from PIL import Image
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
 from pdf2image import convert_from_bytes
-import tempfile
 from pathlib import Path
-import arabic_reshaper
-from bidi.algorithm import get_display
 from docx import Document
-from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
-from docx.shared import Pt
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
 
 
 # -----------------------------
@@ -35,166 +41,631 @@ This app uses PaddleOCR to extract the text and generates an editable .docx file
 # -----------------------------
 # PaddleOCR loader (cached)
 # -----------------------------
-@st.cache_resource(show_spinner="Loading Arabic OCR model…")
-def load_paddle_ocr():
+# Text-line crops recognized per forward pass (PaddleOCR default is 6)
+OCR_REC_BATCH = 16
+
+# CPUs this process may run on; os.cpu_count() reports the whole host, even
+# inside a container pinned to a few cores
+CPU_COUNT = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 4)
+
+# PaddleOCR 2.6 only ships the lightweight PP-OCRv3 models for Arabic, so the
+# speed/quality trade-off is the detector's input size (longest side, px).
+OCR_PROFILES = {
+    "Quality": 960,  # PaddleOCR's default
+    "Speed": 736,
+}
+
+
+def cuda_available() -> bool:
+    """Return True if Paddle was built with CUDA and can see at least one GPU."""
+    try:
+        import paddle
+        return paddle.device.is_compiled_with_cuda() and paddle.device.cuda.device_count() > 0
+    except Exception:
+        return False
+
+
+logger = logging.getLogger(__name__)
+
+
+def ocr_worker_count() -> int:
+    """
+    Return the number of PaddleOCR instances (and OCR threads) per configuration.
+
+    Paddle predictors are not thread-safe, so each OCR thread needs its own
+    instance; CPU cores are split between them. A single GPU gets one. The
+    OCR_WORKERS environment variable overrides the default.
+    """
+    default = 1 if cuda_available() else min(4, max(1, CPU_COUNT // 2))
+    value = os.environ.get("OCR_WORKERS", "").strip()
+    if not value:
+        return default
+    try:
+        return max(1, int(value))
+    except ValueError:
+        logger.warning("Ignoring invalid OCR_WORKERS=%r; using %d", value, default)
+        return default
+
+
+OCR_WORKERS = ocr_worker_count()
+
+
+# Model directories for the TensorRT path. PaddleOCR downloads the models
+# into them and stores each model's TensorRT shape ranges alongside as
+# `<mode>_trt_dynamic_shape.txt`, so they persist across restarts.
+TRT_MODEL_DIR = Path.home() / ".paddleocr" / "arabic-ocr-app-trt"
+TRT_MODEL_DIRS = {f"{mode}_model_dir": str(TRT_MODEL_DIR / mode) for mode in ("det", "rec", "cls")}
+
+
+def trt_warm_up_pages() -> list[np.ndarray]:
+    """
+    Build synthetic pages (BGR) that cover the input shapes the OCR models see.
+
+    Portrait and landscape A4 pages are sized to each OCR profile's detector
+    limit. Each has OCR_REC_BATCH + 1 text lines, so the recognizer sees full
+    batches and a one-crop tail batch. One page per size ramps line length from
+    a single word to the full width; another has only single words, which gives
+    the narrowest batches.
+    """
+    pages: list[np.ndarray] = []
+    n_lines = OCR_REC_BATCH + 1
+    words = "Warm-up 0123456789 ABCDEFGH".split()
+
+    for long_side in sorted(set(OCR_PROFILES.values())):
+        short_side = round(long_side / 1.414)
+        for size, short_lines in (
+            ((short_side, long_side), False),
+            ((short_side, long_side), True),
+            ((long_side, short_side), False),
+            ((long_side, short_side), True),
+        ):
+            page = Image.new("RGB", size, "white")
+            draw = ImageDraw.Draw(page)
+            pitch = size[1] // (n_lines + 1)
+            font = ImageFont.load_default(size=max(8, pitch * 2 // 3))
+            margin = size[0] // 20
+            usable_width = size[0] - 2 * margin
+
+            for row in range(n_lines):
+                # Grow the line word by word up to this row's share of the width
+                target_width = 0 if short_lines else usable_width * (row + 1) / n_lines
+                text = words[0]
+                for i in range(1, 1000):
+                    candidate = f"{text} {words[i % len(words)]}"
+                    if draw.textlength(candidate, font=font) > target_width:
+                        break
+                    text = candidate
+                draw.text((margin, pitch // 2 + row * pitch), text, fill="black", font=font)
+
+            pages.append(np.asarray(page)[:, :, ::-1])
+
+    return pages
+
+
+def trt_shapes_tuned(use_angle_cls: bool) -> bool:
+    """Return True if TensorRT shape ranges are recorded for every model in use."""
+    modes = ["det", "rec", "cls"] if use_angle_cls else ["det", "rec"]
+    return all((TRT_MODEL_DIR / mode / f"{mode}_trt_dynamic_shape.txt").exists() for mode in modes)
+
+
+def collect_trt_shapes(trt_options: dict, use_angle_cls: bool):
+    """
+    Record TensorRT shape ranges by running the warm-up pages through a collecting instance.
+    """
+    from paddleocr import PaddleOCR
+
+    # While a range file is missing, PaddleOCR's predictor only collects shapes;
+    # Paddle writes them out when the predictor is released. The detector limit
+    # is the largest profile's so one instance sees every profile's page sizes
+    # (pages at or below the limit are not resized).
+    collector = PaddleOCR(**{**trt_options, "det_limit_side_len": max(OCR_PROFILES.values())})
+    completed = False
+    try:
+        for page in trt_warm_up_pages():
+            collector.ocr(page, cls=use_angle_cls)
+        completed = True
+    finally:
+        del collector
+        gc.collect()
+        if not completed:
+            # Drop whatever partial ranges were written so the next start
+            # collects them again instead of tuning engines against them
+            for mode in ("det", "rec", "cls"):
+                (TRT_MODEL_DIR / mode / f"{mode}_trt_dynamic_shape.txt").unlink(missing_ok=True)
+
+
+def load_paddle_ocr(use_angle_cls: bool = False, profile: str = "Quality"):
+    """Build one PaddleOCR instance for a configuration (pooled by ocr_pool)."""
     from paddleocr import PaddleOCR
-    # CPU mode for broad compatibility; change use_gpu=True if GPU available
-    return PaddleOCR(use_angle_cls=True, lang="ar", use_gpu=False)
 
+    # The 180° angle classifier is only loaded when asked for
+    common = dict(
+        use_angle_cls=use_angle_cls,
+        lang="ar",
+        det_limit_side_len=OCR_PROFILES[profile],
+        rec_batch_num=OCR_REC_BATCH,
+    )
+
+    if cuda_available():
+        # TensorRT FP16 engines on the GPU; gpu_mem caps the initial pool (MB)
+        trt = dict(use_gpu=True, use_tensorrt=True, precision="fp16", gpu_mem=8000, **TRT_MODEL_DIRS, **common)
+        try:
+            # First start: record shape ranges so the engines built below are
+            # specialized to them. Later starts reuse the files.
+            if not trt_shapes_tuned(use_angle_cls):
+                collect_trt_shapes(trt, use_angle_cls)
+            return PaddleOCR(**trt)
+        except Exception:
+            # E.g. Paddle built without TensorRT, a failed model download or GPU
+            # out of memory. Record why, then fall back: plain CUDA kernels are
+            # still far ahead of CPU.
+            logger.exception("TensorRT OCR setup failed; falling back to plain CUDA")
+            return PaddleOCR(use_gpu=True, gpu_mem=8000, **common)
+
+    # CPU fallback: MKLDNN (oneDNN) kernels, this worker's share of the cores
+    return PaddleOCR(use_gpu=False, enable_mkldnn=True, cpu_threads=max(1, CPU_COUNT // OCR_WORKERS), **common)
+
+
+# Pools for at most three angle-classifier/profile configurations are kept;
+# the least recently used one is evicted instead of piling up.
+@st.cache_resource(show_spinner="Loading Arabic OCR model…", max_entries=3)
+def ocr_pool(use_angle_cls: bool = False, profile: str = "Quality") -> queue.Queue:
+    """
+    Return the process-wide pool of idle PaddleOCR instances for a configuration.
 
-ocr = load_paddle_ocr()
+    Every session borrows from this one queue, so an instance is never used by
+    two threads at once, even when several sessions run OCR concurrently.
+    """
+    pool: queue.Queue = queue.Queue()
+    for _ in range(OCR_WORKERS):
+        pool.put(load_paddle_ocr(use_angle_cls, profile))
+    return pool
+
+
+@st.cache_resource(show_spinner=False)
+def warm_up_default_ocr_pool():
+    # Cached itself, so later reruns do not touch ocr_pool's LRU order
+    ocr_pool()
+
+
+# Warm the default configuration once at startup
+warm_up_default_ocr_pool()
 
 
 # -----------------------------
 # Helper functions
 # -----------------------------
-def pdf_to_images(file_bytes: bytes, dpi: int = 300):
+# Longest side of uploaded images handed to OCR (PDF pages are rasterized at the
+# chosen DPI instead). The detector resizes to ~960px, but text-line crops are
+# cut from the page itself, so keep headroom for small Arabic print.
+OCR_MAX_SIDE = 2000
+
+# Duplicate-page detection: a 63-bit perceptual hash (low-frequency DCT of a
+# 32x32 grayscale page) buckets candidates. AC terms within PHASH_TOLERANCE * DC
+# of the median count as 0, so scanner noise on blank pages does not flip bits.
+# A hash match is only confirmed if the two pages have identical grayscale
+# pixels, or if both are near-blank: after 2x2 box averaging (which halves
+# scanner noise) no pixel differs from the page background, lighter or darker,
+# by more than PAGE_BLANK_MAX_DEVIATION grey levels. Any text with more contrast
+# than that, including faded grey or white-on-black print, makes a page
+# non-blank, so pages with different text are never merged.
+PHASH_SIZE = 32
+PHASH_TOLERANCE = 0.002
+PHASH_DCT = np.cos(
+    np.pi * (2 * np.arange(PHASH_SIZE)[None, :] + 1) * np.arange(PHASH_SIZE)[:, None] / (2 * PHASH_SIZE)
+)
+PAGE_BLANK_MAX_DEVIATION = 16
+
+
+def pdf_to_images(file_bytes: bytes, dpi: int = 200):
     """Convert a PDF (bytes) to a list of PIL images."""
-    return convert_from_bytes(file_bytes, dpi=dpi)
+    # One pdftoppm worker per core, each rasterizing its own page range
+    return convert_from_bytes(file_bytes, dpi=dpi, thread_count=CPU_COUNT)
 
 
-def run_ocr_on_image(pil_image: Image.Image) -> list[str]:
+def downscale_for_ocr(images: list[Image.Image]) -> list[Image.Image]:
     """
-    Run PaddleOCR on a PIL image and return a list of recognized text lines.
+    Shrink oversized pages in place so their longest side is at most OCR_MAX_SIDE.
     """
-    page_lines: list[str] = []
+    for page_img in images:
+        if max(page_img.size) > OCR_MAX_SIDE:
+            page_img.thumbnail((OCR_MAX_SIDE, OCR_MAX_SIDE), Image.LANCZOS)
+    return images
+
+
+def open_uploaded_image(file_bytes: bytes) -> Image.Image:
+    """Decode an uploaded image (bytes) into an RGB PIL image sized for OCR."""
+    img = Image.open(io.BytesIO(file_bytes))
+    # JPEGs decode straight at a reduced DCT scale when they are larger
+    # than OCR needs (no-op for other formats)
+    img.draft("RGB", (OCR_MAX_SIDE, OCR_MAX_SIDE))
+    # convert() copies even when the mode already matches
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    return downscale_for_ocr([img])[0]
+
+
+def preview_jpeg(pil_image: Image.Image, max_side: int = 800) -> bytes:
+    """Encode a small JPEG thumbnail of a page for the on-screen preview."""
+    thumb = pil_image.copy()
+    thumb.thumbnail((max_side, max_side))
+    if thumb.mode not in ("RGB", "L"):
+        thumb = thumb.convert("RGB")
+    buffer = io.BytesIO()
+    thumb.save(buffer, format="JPEG", quality=75)
+    return buffer.getvalue()
+
+
+def image_preview_jpeg(file_bytes: bytes, max_side: int = 800) -> bytes:
+    """Decode an uploaded image at preview size and encode it as a small JPEG."""
+    img = Image.open(io.BytesIO(file_bytes))
+    # JPEGs decode at a reduced DCT scale close to the preview size
+    img.draft("RGB", (max_side, max_side))
+    return preview_jpeg(img, max_side)
+
+
+def pdf_preview_jpeg(file_bytes: bytes) -> bytes:
+    """Rasterize only the first PDF page, at preview size, and encode it as JPEG."""
+    first_page = convert_from_bytes(file_bytes, first_page=1, last_page=1, size=800)
+    return preview_jpeg(first_page[0])
+
+
+def pil_to_ocr_array(pil_image: Image.Image, grayscale: bool = False) -> np.ndarray:
+    """
+    Convert a PIL image to the ndarray layout PaddleOCR expects.
 
-    # Use a temporary file because PaddleOCR expects a file path
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-        pil_image.save(tmp.name, format="JPEG")
-        temp_path = tmp.name
+    Colour pages become BGR (like OpenCV). Grayscale pages stay single-channel;
+    PaddleOCR expands 2-D arrays to 3-channel BGR itself.
+    """
+    if grayscale:
+        if pil_image.mode != "L":
+            pil_image = pil_image.convert("L")
+        return np.asarray(pil_image)
 
-    try:
-        result = ocr.ocr(temp_path, cls=True) or []
-        # result is typically a list of [ [box], [text, conf] ]
-        for line in result:
-            try:
-                text = line[1][0]
-                if isinstance(text, str) and text.strip():
-                    page_lines.append(text.strip())
-            except Exception:
-                # robust to unexpected OCR result structures
-                continue
-    finally:
-        # Clean up the temp image
-        Path(temp_path).unlink(missing_ok=True)
+    if pil_image.mode != "RGB":
+        pil_image = pil_image.convert("RGB")
+    return np.asarray(pil_image)[:, :, ::-1]
+
+
+def lines_from_result(page_result) -> list[str]:
+    """
+    Extract the recognized text lines from one page of PaddleOCR output.
+    """
+    page_lines: list[str] = []
+
+    # page_result is typically a list of [ [box], [text, conf] ]
+    for line in page_result or []:
+        try:
+            text = line[1][0]
+            if isinstance(text, str) and text.strip():
+                page_lines.append(text.strip())
+        except Exception:
+            # robust to unexpected OCR result structures
+            continue
 
     return page_lines
 
 
-def add_arabic_paragraph(doc: Document, text: str):
+def page_phash(pil_image: Image.Image) -> bytes:
     """
-    Add a properly shaped, RTL Arabic paragraph to a Word document.
+    Return a page's perceptual hash.
     """
-    reshaped = arabic_reshaper.reshape(text)
-    bidi_text = get_display(reshaped)
+    thumb = np.asarray(pil_image.resize((128, 128), Image.BOX).convert("L"), dtype=np.float32)
+    small = thumb.reshape(PHASH_SIZE, 4, PHASH_SIZE, 4).mean(axis=(1, 3))
 
-    p = doc.add_paragraph(bidi_text)
-    p.paragraph_format.right_to_left = True
-    p.paragraph_format.alignment = WD_PARAGRAPH_ALIGNMENT.RIGHT
-    p.paragraph_format.line_spacing = 1.15
+    coeffs = PHASH_DCT @ small @ PHASH_DCT.T
+    low = coeffs[:8, :8].ravel()[1:]  # drop the DC term
+    bits = low - np.median(low) > PHASH_TOLERANCE * coeffs[0, 0]
 
-    for run in p.runs:
-        run.font.size = Pt(12)
-        # Set a primary Arabic font; Word will fallback if missing
-        run.font.name = "Arabic Typesetting"
+    return np.packbits(bits).tobytes()
+
+
+def page_is_blank(pil_image: Image.Image) -> bool:
+    """
+    Return True if nothing on the page stands out from its background, lighter or darker.
+    """
+    gray = np.asarray(pil_image.convert("L").reduce(2), dtype=np.int16)
+    return int(np.abs(gray - int(np.median(gray))).max()) <= PAGE_BLANK_MAX_DEVIATION
+
+
+def duplicate_page_sources(images: list[Image.Image]) -> list[int]:
+    """
+    For each page, return the index of the first page it duplicates (itself if unique).
+    """
+    blank: dict[int, bool] = {}
+
+    def is_blank(idx: int) -> bool:
+        if idx not in blank:
+            blank[idx] = page_is_blank(images[idx])
+        return blank[idx]
+
+    def same_page(a: int, b: int) -> bool:
+        if images[a].size != images[b].size:
+            return False
+        if is_blank(a) and is_blank(b):
+            return True
+        return np.array_equal(np.asarray(images[a].convert("L")), np.asarray(images[b].convert("L")))
+
+    seen: dict[bytes, list[int]] = {}
+    sources: list[int] = []
+
+    for page_idx, page_img in enumerate(images):
+        candidates = seen.setdefault(page_phash(page_img), [])
+
+        for first_idx in candidates:
+            if same_page(page_idx, first_idx):
+                sources.append(first_idx)
+                break
+        else:
+            candidates.append(page_idx)
+            sources.append(page_idx)
+
+    return sources
+
+
+def run_ocr_on_images(
+    images: list[Image.Image],
+    grayscale: bool = False,
+    use_angle_cls: bool = False,
+    profile: str = "Quality",
+) -> list[list[str]]:
+    """
+    Run PaddleOCR on every page and return the recognized text lines per page.
+
+    Pages are spread over a thread pool; Paddle releases the GIL during inference.
+    Repeated pages (blank or separator sheets) are only OCR'd once.
+    """
+    # PaddleOCR 2.6 rejects a list of images when detection is enabled, so each
+    # task takes one page; the recognizer still batches crops per page.
+    idle_engines = ocr_pool(use_angle_cls, profile)
+
+    def ocr_page(page_img: Image.Image) -> list[str]:
+        engine = idle_engines.get()
+        try:
+            # Pass the pixels straight to PaddleOCR; no lossy JPEG/disk round-trip
+            result = engine.ocr(pil_to_ocr_array(page_img, grayscale), cls=use_angle_cls) or []
+        finally:
+            idle_engines.put(engine)
+        # One entry per input image
+        return lines_from_result(result[0] if result else None)
+
+    sources = duplicate_page_sources(images)
+    unique_pages = sorted(set(sources))
+
+    progress = st.progress(0.0, text="Running OCR…")
+
+    with ThreadPoolExecutor(max_workers=max(1, min(OCR_WORKERS, len(unique_pages)))) as pool:
+        futures = {page_idx: pool.submit(ocr_page, images[page_idx]) for page_idx in unique_pages}
+        # Progress is reported from the script thread; results keep page order below
+        for done, _ in enumerate(as_completed(futures.values()), start=1):
+            progress.progress(done / len(unique_pages), text=f"Processed {done} of {len(unique_pages)} unique page(s)")
+
+    return [list(futures[source].result()) for source in sources]
+
+
+# In memory only, and bounded: uploaded documents' text is not written to the
+# server's disk, at most OCR_CACHE_MAX_ENTRIES results are kept, each for at
+# most an hour, and a restart (e.g. a deploy) never serves results from older code.
+OCR_CACHE_MAX_ENTRIES = 32
+
+
+@st.cache_data(max_entries=OCR_CACHE_MAX_ENTRIES, ttl="1h", show_spinner=False)
+def ocr_upload(
+    file_hash: str,
+    is_image: bool,
+    dpi: int,
+    grayscale: bool,
+    use_angle_cls: bool,
+    profile: str,
+    _file_bytes: bytes,
+) -> list[list[str]]:
+    """
+    Decode/rasterize an upload and OCR every page, cached by file hash and OCR settings.
+
+    The cache is shared across sessions, so uploading the same file again skips
+    both rasterization and OCR.
+    """
+    if is_image:
+        images = [open_uploaded_image(_file_bytes)]
+    else:
+        # The DPI slider sets the OCR resolution; pages are not capped further
+        images = pdf_to_images(_file_bytes, dpi=dpi)
+
+    if not images:
+        return []
+
+    return run_ocr_on_images(images, grayscale, use_angle_cls, profile)
+
+
+# RTL paragraph, right-aligned, 1.15 line spacing (276/240); 12pt (sz is in
+# half-points) with a primary Arabic font, Word falls back if it is missing.
+ARABIC_PARAGRAPH_XML = (
+    '<w:p>'
+    '<w:pPr><w:bidi/><w:spacing w:line="276" w:lineRule="auto"/><w:jc w:val="right"/></w:pPr>'
+    '<w:r>'
+    '<w:rPr>'
+    '<w:rFonts w:ascii="Arabic Typesetting" w:hAnsi="Arabic Typesetting" w:cs="Arabic Typesetting"/>'
+    '<w:sz w:val="24"/><w:szCs w:val="24"/><w:rtl/>'
+    '</w:rPr>'
+    '<w:t xml:space="preserve">{text}</w:t>'
+    '</w:r>'
+    '</w:p>'
+)
+
+
+def add_arabic_paragraphs(doc: Document, lines: list[str]):
+    """
+    Add one RTL Arabic paragraph per line to a Word document.
+
+    Text is stored in logical order; Word shapes and reorders it at render time.
+    The paragraphs are built as a single XML fragment and parsed once, rather
+    than going through python-docx's per-paragraph/per-run object layer.
+    """
+    if not lines:
+        return
+
+    paragraphs_xml = "".join(ARABIC_PARAGRAPH_XML.format(text=escape(line)) for line in lines)
+    fragment = parse_xml(f"<w:body {nsdecls('w')}>{paragraphs_xml}</w:body>")
+
+    # Paragraphs must stay ahead of the body's trailing section properties
+    body = doc.element.body
+    sect_pr = body.sectPr
+    for p in list(fragment):
+        if sect_pr is not None:
+            sect_pr.addprevious(p)
+        else:
+            body.append(p)
+
+
+def pages_preview_text(pages: list[tuple[int, list[str]]]) -> str:
+    """
+    Build the plain-text preview of all pages, with a header per page.
+    """
+    preview = io.StringIO()
+
+    for page_num, page_lines in pages:
+        preview.write(f"— Page {page_num} —\n")
+        if page_lines:
+            preview.writelines(f"{line}\n" for line in page_lines)
+        else:
+            preview.write("[No text detected]\n")
+        preview.write("\n")
+
+    return preview.getvalue().strip()
+
+
+@st.fragment
+def show_results(docx_bytes: bytes, download_name: str, combined_text: str):
+    """
+    Render the download button and text preview.
+
+    Runs as a fragment so clicking download reruns only this block and the
+    results stay on screen without re-running the form.
+    """
+    st.download_button(
+        label="📥 Download Word (.docx)",
+        data=docx_bytes,
+        file_name=download_name,
+        mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    )
+
+    # Text preview
+    with st.expander("View extracted text"):
+        st.text_area("Raw extracted text", value=combined_text or "No text found.", height=250)
+
+    st.info(
+        "Tip: In Word, if text direction looks off, use Right‑to‑Left paragraph direction "
+        "(e.g., Ctrl + Right Shift)."
+    )
 
 
 # -----------------------------
 # File upload UI
 # -----------------------------
-uploaded_file = st.file_uploader(
-    "Upload scanned PDF or image",
-    type=["pdf", "jpg", "jpeg", "png"]
-)
+# Widgets are batched in a form: changing a setting does not rerun
+# rasterization or OCR until the form is submitted.
+with st.form("ocr_form"):
+    uploaded_file = st.file_uploader(
+        "Upload scanned PDF or image",
+        type=["pdf", "jpg", "jpeg", "png"]
+    )
+
+    # PaddleOCR's detector downsizes pages to ~960px anyway; 200 DPI keeps
+    # small Arabic text legible at ~2.25x fewer pixels than 300 DPI.
+    dpi = st.slider(
+        "Rasterization DPI (PDF only)",
+        min_value=120,
+        max_value=300,
+        value=200,
+        step=10,
+        help="Higher values help with very small print but slow down conversion and OCR.",
+    )
+    grayscale = st.checkbox(
+        "Convert to grayscale before OCR",
+        help="Can help with noisy or colour-tinted scans.",
+    )
+    use_angle_cls = st.checkbox(
+        "Scan may be rotated 180°",
+        help=(
+            "Runs PaddleOCR's text-direction classifier on every detected line. "
+            "Leave off for upright scans; slight skew is handled by the detector alone."
+        ),
+    )
+    profile = st.radio(
+        "Quality / Speed",
+        options=list(OCR_PROFILES),
+        horizontal=True,
+        help="Speed runs text detection on a smaller image; very small print may be missed.",
+    )
 
-if uploaded_file is None:
+    # Trigger OCR + DOCX generation
+    submitted = st.form_submit_button("Extract Text & Create Word File")
+
+if not submitted:
     st.info("Please upload a scanned PDF or an image file to get started.")
+elif uploaded_file is None:
+    st.error("Please upload a scanned PDF or an image file first.")
 else:
     file_bytes = uploaded_file.getvalue()
     file_name = uploaded_file.name
+    # blake2b is fast enough that hashing is negligible next to OCR
+    file_hash = hashlib.blake2b(file_bytes).hexdigest()
+    is_image = uploaded_file.type.startswith("image/")
 
     st.success(f"File uploaded: {file_name}")
 
     # Preview section
-    if uploaded_file.type.startswith("image/"):
+    try:
+        if is_image:
+            # Streamlit would decode and re-encode anything wider than its
+            # layout in the source format (a full-size PNG encode for PNG
+            # scans), so hand it a small JPEG thumbnail instead
+            st.image(image_preview_jpeg(file_bytes), caption="Preview", use_column_width=True)
+        else:
+            # Only page 1 is rasterized, at thumbnail size, for the preview
+            st.image(pdf_preview_jpeg(file_bytes), caption="Preview (page 1)", use_column_width=True)
+    except Exception as e:
+        st.error(f"Could not open {'image' if is_image else 'PDF'}: {e}")
+        st.stop()
+
+    with st.spinner("Running Arabic OCR on all pages…"):
         try:
-            img = Image.open(uploaded_file).convert("RGB")
-            st.image(img, caption="Preview", use_column_width=True)
-            images = [img]
+            # DPI has no effect on image uploads; keep it out of their cache key
+            ocr_dpi = 0 if is_image else dpi
+            pages_lines = ocr_upload(file_hash, is_image, ocr_dpi, grayscale, use_angle_cls, profile, file_bytes)
         except Exception as e:
-            st.error(f"Could not open image: {e}")
-            st.stop()
-    else:
-        # PDF case
-        with st.spinner("Converting PDF pages to images…"):
-            try:
-                images = pdf_to_images(file_bytes, dpi=300)
-            except Exception as e:
-                st.error(f"Error converting PDF to images: {e}")
-                st.stop()
-
-        st.info(f"Detected {len(images)} page(s) in the PDF.")
-
-    # Trigger OCR + DOCX generation
-    if st.button("Extract Text & Create Word File"):
-        if not images:
-            st.error("No pages/images were found to process.")
+            st.error(f"Error processing {file_name}: {e}")
             st.stop()
 
-        with st.spinner("Running Arabic OCR on all pages…"):
-            doc = Document()
-            doc.add_heading(f"Extracted from: {file_name}", level=1)
-
-            all_page_texts: list[str] = []
-
-            for page_num, page_img in enumerate(images, start=1):
-                st.write(f"Processing page {page_num} of {len(images)}…")
-
-                page_lines = run_ocr_on_image(page_img)
-                page_text = "\n".join(page_lines).strip()
-
-                if page_text:
-                    all_page_texts.append(f"— Page {page_num} —\n{page_text}")
+    if not pages_lines:
+        st.error("No pages/images were found to process.")
+        st.stop()
 
-                    # For better RTL behavior, add paragraph per line
-                    for line in page_lines:
-                        add_arabic_paragraph(doc, line)
+    if not is_image:
+        st.info(f"Detected {len(pages_lines)} page(s) in the PDF.")
 
-                    # Add a page break between pages, not after the last page
-                    if page_num < len(images):
-                        doc.add_page_break()
-                else:
-                    all_page_texts.append(f"— Page {page_num} —\n[No text detected]")
+    pages = list(enumerate(pages_lines, start=1))
 
-            # Save Word to a temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as tmp_docx:
-                doc.save(tmp_docx.name)
-                docx_path = tmp_docx.name
+    doc = Document()
+    doc.add_heading(f"Extracted from: {file_name}", level=1)
 
-        st.success("OCR complete! Your editable Word file is ready.")
+    for page_num, page_lines in pages:
+        if page_lines:
+            # For better RTL behavior, add paragraph per line
+            add_arabic_paragraphs(doc, page_lines)
 
-        # Download button
-        base_name = Path(file_name).stem
-        download_name = f"arabic_ocr_{base_name}.docx"
+            # Add a page break between pages, not after the last page
+            if page_num < len(pages):
+                doc.add_page_break()
 
-        with open(docx_path, "rb") as f:
-            st.download_button(
-                label="📥 Download Word (.docx)",
-                data=f,
-                file_name=download_name,
-                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            )
+    # Save Word in memory; no temp file to write, re-read and clean up
+    docx_buffer = io.BytesIO()
+    doc.save(docx_buffer)
 
-        # Text preview
-        combined_text = "\n\n".join(all_page_texts).strip()
-        with st.expander("View extracted text"):
-            st.text_area("Raw extracted text", value=combined_text or "No text found.", height=250)
+    st.success("OCR complete! Your editable Word file is ready.")
 
-        st.info(
-            "Tip: In Word, if text direction looks off, use Right‑to‑Left paragraph direction "
-            "(e.g., Ctrl + Right Shift)."
-        )
+    base_name = Path(file_name).stem
+    show_results(docx_buffer.getvalue(), f"arabic_ocr_{base_name}.docx", pages_preview_text(pages))
 
 st.markdown("---")
 st.caption("Powered by PaddleOCR – accurate Arabic extraction ❤️")